@@ -5,12 +5,74 @@ This module handles interaction with Gemini Pro LLM, enforcing
 strict JSON-only tool requests and managing the conversation flow.
 """
 
-import json
+import asyncio
+import datetime
+import re
+import threading
+import time
+import orjson
 import google.generativeai as genai
-from typing import Dict, Any, Optional, List
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import caching
+from typing import Dict, Any, Optional, List, Iterator, Tuple
 from mcp_server import MCPServer
 
 
+MODEL_NAME = 'models/gemma-3-4b-it'
+
+# Canned (deterministic) analyses only need a short summary, so their output
+# is bounded; answers cut off at the limit are flagged as truncated
+CANNED_GENERATION_CONFIG = {"temperature": 0.4, "max_output_tokens": 1024}
+
+# Appended to an answer that stopped at the output token limit
+TRUNCATION_NOTICE = "\n\n_(Summary truncated at the output length limit.)_"
+
+# Gemma models served through the Gemini API reject JSON mode / response schemas
+JSON_MODE_SUPPORTED = not MODEL_NAME.startswith('models/gemma')
+
+# Response schema constraining tool-selection turns to a valid tool request
+TOOL_CALL_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'tool': {'type': 'string', 'enum': ['read_logs', 'parse_logs', 'analyze_logs', 'merge_analyses']},
+        'arguments': {
+            'type': 'object',
+            'properties': {
+                'file_names': {'type': 'array', 'items': {'type': 'string'}},
+                # Log text is passed as a "@result_N" reference to a read_logs result
+                'log_text': {'type': 'string'},
+                'artifact_id': {'type': 'string'},
+                'artifact_ids': {'type': 'array', 'items': {'type': 'string'}}
+            }
+        }
+    },
+    'required': ['tool', 'arguments']
+}
+
+# Prefix of argument values that refer to an earlier tool result ("@result_1")
+RESULT_REF_PREFIX = '@result_'
+
+# Tool whose result each argument may reference: log_text takes the joined
+# read_logs contents, artifact_id(s) the parse_logs artifact
+RESULT_REF_SOURCES = {'log_text': 'read_logs', 'artifact_id': 'parse_logs', 'artifact_ids': 'parse_logs'}
+
+# Tools whose successful result ends the tool phase of the agentic loop
+ANALYSIS_TOOLS = ('analyze_logs', 'merge_analyses')
+
+# Earlier tool-loop exchanges kept in the chat history besides the opening
+# one (the SDK resends the whole client-side history on every turn)
+CHAT_HISTORY_WINDOW = 3
+
+# How long the cached system prompt + tool descriptions stay alive server-side
+CONTEXT_CACHE_TTL = datetime.timedelta(minutes=10)
+
+# Explicit context caching is unavailable for Gemma and needs a preamble of at
+# least this many tokens. The shipped preamble is ~500 tokens, so with the
+# default configuration no cache is created and the preamble is sent inline.
+CONTEXT_CACHE_SUPPORTED = not MODEL_NAME.startswith('models/gemma')
+CONTEXT_CACHE_MIN_TOKENS = 4096
+
+
 class GeminiAgent:
     """
     Agent that uses Gemini Pro for reasoning and MCP server for execution.
@@ -19,6 +81,9 @@ class GeminiAgent:
     - Gemini Pro: Reasoning and decision-making
     - MCP Server: Tool execution (deterministic operations)
     """
+
+    # Matches the body of a ``` / ```json fenced code block
+    _FENCED_BLOCK_RE = re.compile(r'```(?:json)?(.*?)```', re.DOTALL)
     
     def __init__(self, api_key: str):
         """
@@ -28,8 +93,12 @@ class GeminiAgent:
             api_key: Google Gemini API key
         """
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('models/gemma-3-4b-it')
         self.mcp_server = MCPServer()
+
+        # The SDK's async client binds to the event loop it is first used on,
+        # so synchronous callers always run on this one loop
+        self._loop = asyncio.new_event_loop()
+        self._loop_lock = threading.Lock()
         
         # System prompt that enforces strict JSON tool requests
         self.system_prompt = """You are a log analysis assistant. Your role is to analyze ONLY the provided log files.
@@ -42,19 +111,88 @@ CRITICAL RULES:
    {"tool": "tool_name", "arguments": {"param1": "value1", "param2": "value2"}}
 5. Do NOT include any text before or after the JSON.
 6. Do NOT explain what you're doing - just return the JSON.
+7. Large tool results are shown truncated. To pass a result to the next tool, use its
+   reference (e.g. "@result_1") as the argument value instead of copying the data.
 
 Available tools:
 - read_logs(file_names): Reads allowed log files (default + uploaded) and returns contents
 - parse_logs(log_text): Parses raw log text into structured format
-- analyze_logs(parsed_logs): Analyzes parsed logs to extract statistics
+- analyze_logs(artifact_id): Analyzes the parsed logs stored by parse_logs to extract statistics
+- merge_analyses(artifact_ids): Analyzes several parsed logs and merges their statistics
 
 Workflow:
 1. Use read_logs with an explicit list of allowed file names to get content.
 2. Use parse_logs on the retrieved content.
-3. Use analyze_logs on parsed entries.
+3. Use analyze_logs with the artifact_id returned by parse_logs.
 4. Provide a natural language summary using tool results.
 
 If a needed log file is not listed, state that it is unavailable instead of inventing a name."""
+
+        # Tool descriptions are static; build them once for every prompt
+        self._tool_descriptions = self.get_tool_descriptions()
+
+        # Register the invariant preamble once so each turn only sends the delta
+        self._setup_context_cache()
+
+        # Final answers in agentic mode; kept apart from self.model so the
+        # JSON-only system instruction cached there does not apply to them
+        self.model_answer = genai.GenerativeModel(MODEL_NAME)
+
+        # Final answers for canned analyses, with bounded output
+        self.model_canned = genai.GenerativeModel(MODEL_NAME, generation_config=CANNED_GENERATION_CONFIG)
+
+        # Constrain tool-selection turns to schema-valid JSON where the model
+        # allows it; otherwise fall back to extracting JSON from free text
+        self.tool_call_config = None
+        if JSON_MODE_SUPPORTED:
+            self.tool_call_config = {
+                "response_mime_type": "application/json",
+                "response_schema": TOOL_CALL_SCHEMA
+            }
+
+    def _setup_context_cache(self) -> None:
+        """Creates the context cache and builds the main model on top of it."""
+        self.cache = self._create_context_cache()
+        # Refresh a minute early so a turn never references an expired cache
+        self._cache_expires_at = time.monotonic() + CONTEXT_CACHE_TTL.total_seconds() - 60
+        if self.cache is not None:
+            self.model = genai.GenerativeModel.from_cached_content(cached_content=self.cache)
+        else:
+            self.model = genai.GenerativeModel(MODEL_NAME)
+
+    def _refresh_context_cache(self) -> None:
+        """
+        Recreates the context cache once its TTL has run out.
+
+        The UI reuses one agent across reruns, so it can outlive the cache.
+        """
+        if self.cache is not None and time.monotonic() >= self._cache_expires_at:
+            self._setup_context_cache()
+
+    def _create_context_cache(self) -> Optional[caching.CachedContent]:
+        """
+        Caches the system prompt and tool descriptions via Gemini context caching.
+
+        Returns:
+            Cached content handle, or None if the model or the preamble does
+            not qualify for explicit caching (the preamble is then sent inline
+            with the prompt). Other API errors, such as authentication or
+            network failures, are raised.
+        """
+        # Skip the API call when it could only be rejected (~4 chars per token)
+        preamble_tokens = (len(self.system_prompt) + len(self._tool_descriptions)) // 4
+        if not CONTEXT_CACHE_SUPPORTED or preamble_tokens < CONTEXT_CACHE_MIN_TOKENS:
+            return None
+
+        try:
+            return caching.CachedContent.create(
+                model=MODEL_NAME,
+                system_instruction=self.system_prompt,
+                contents=[self._tool_descriptions],
+                ttl=CONTEXT_CACHE_TTL
+            )
+        except (google_exceptions.InvalidArgument, google_exceptions.NotFound):
+            return None
     
     def get_tool_descriptions(self) -> str:
         """
@@ -85,128 +223,317 @@ If a needed log file is not listed, state that it is unavailable instead of inve
         Returns:
             Parsed tool request or None
         """
-        # Try direct JSON parsing
-        parsed = self.mcp_server.parse_tool_request(response)
-        if parsed:
-            return parsed
-        
-        # Try to find JSON in code blocks
-        if '```json' in response:
-            start = response.find('```json') + 7
-            end = response.find('```', start)
-            if end > start:
-                json_str = response[start:end].strip()
-                parsed = self.mcp_server.parse_tool_request(json_str)
-                if parsed:
-                    return parsed
-        
+        # The MCP server's parser handles a bare JSON response (always so in
+        # JSON mode) and the first balanced object embedded in prose
+        tool_request = self.mcp_server.parse_tool_request(response)
+        if tool_request:
+            return tool_request
+
+        # Otherwise look inside fenced code blocks, e.g. when prose with its
+        # own braces comes before a ```json block
         if '```' in response:
-            start = response.find('```') + 3
-            end = response.find('```', start)
-            if end > start:
-                json_str = response[start:end].strip()
-                if json_str.startswith('{'):
-                    parsed = self.mcp_server.parse_tool_request(json_str)
-                    if parsed:
-                        return parsed
+            for match in self._FENCED_BLOCK_RE.finditer(response):
+                tool_request = self.mcp_server.parse_tool_request(match.group(1))
+                if tool_request:
+                    return tool_request
         
         return None
     
-    def process_query(self, user_query: str, available_files: List[str], max_iterations: int = 10) -> Dict[str, Any]:
+    @staticmethod
+    def _summarize_for_llm(result: Dict[str, Any], max_chars: int = 2000, sample_size: int = 5) -> Dict[str, Any]:
         """
-        Process a user query by coordinating between Gemini Pro and MCP server.
+        Condenses a tool result before it is fed back to Gemini.
+
+        Long strings are truncated and long lists sampled; the full result
+        stays in tool_results for the final answer.
 
         Args:
-            user_query: User's question about logs
-            available_files: List of allowed file names/paths for this session
-            max_iterations: Maximum number of tool calls allowed
+            result: Tool result from the MCP server
+            max_chars: Maximum characters kept per string value
+            sample_size: Maximum items kept per list value
 
         Returns:
-            Dictionary with final answer and execution history
+            Condensed copy of the result
+        """
+        def condense(value: Any) -> Any:
+            if isinstance(value, str) and len(value) > max_chars:
+                return value[:max_chars] + f"... [{len(value) - max_chars} more characters]"
+            if isinstance(value, list) and len(value) > sample_size:
+                return [condense(item) for item in value[:sample_size]] + [f"... [{len(value) - sample_size} more items]"]
+            if isinstance(value, dict):
+                return {key: condense(item) for key, item in value.items()}
+            return value
+
+        return condense(result)
+
+    @staticmethod
+    def _resolve_result_refs(arguments: Dict[str, Any],
+                             tool_results: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        Replaces "@result_N" argument values with the data of the N-th tool result.
+
+        read_logs results resolve to the joined file contents (for log_text)
+        and parse_logs results to their artifact_id (for artifact_id, or
+        items of artifact_ids).
+
+        Args:
+            arguments: Tool arguments as requested by Gemini
+            tool_results: Tool results of the current query
+
+        Returns:
+            Tuple of (arguments with references resolved, error_message); the
+            error is set when a reference is unknown, failed or of the wrong tool
+        """
+        def resolve(key: str, value: str) -> Tuple[Any, Optional[str]]:
+            index = value[len(RESULT_REF_PREFIX):]
+            if not (index.isdigit() and 1 <= int(index) <= len(tool_results)):
+                return value, f"Reference {value} does not exist"
+            expected_tool = RESULT_REF_SOURCES.get(key)
+            if expected_tool is None:
+                return value, f"Argument {key} does not accept result references"
+            ref = tool_results[int(index) - 1]
+            if ref['tool'] != expected_tool or not ref['result'].get('success'):
+                return value, f"Reference {value} is not a successful {expected_tool} result"
+            if expected_tool == 'read_logs':
+                return "\n".join(ref['result']['files'].values()), None
+            return ref['result']['artifact_id'], None
+
+        def is_ref(value: Any) -> bool:
+            return isinstance(value, str) and value.startswith(RESULT_REF_PREFIX)
+
+        resolved = {}
+        for key, value in arguments.items():
+            if is_ref(value):
+                value, error = resolve(key, value)
+                if error:
+                    return arguments, error
+            elif isinstance(value, list) and any(is_ref(item) for item in value):
+                items = []
+                for item in value:
+                    if is_ref(item):
+                        item, error = resolve(key, item)
+                        if error:
+                            return arguments, error
+                    items.append(item)
+                value = items
+            resolved[key] = value
+        return resolved, None
+
+    @staticmethod
+    def _stream_text(response: Any, result: Dict[str, Any]) -> Iterator[str]:
+        """
+        Yields the text of a streaming Gemini response chunk by chunk.
+
+        If generation fails midway, a notice is yielded and the error is
+        recorded in result['answer_error'] so callers do not treat the
+        partial answer as complete. An answer that stops at the output
+        token limit gets a notice and result['answer_truncated'].
+
+        Args:
+            response: Response from generate_content(..., stream=True)
+            result: process_query result the stream belongs to
+
+        Returns:
+            Iterator over answer text chunks
+        """
+        chunk = None
+        try:
+            for chunk in response:
+                yield chunk.text
+        except Exception as e:
+            result['answer_error'] = str(e)
+            yield f"\n\nFailed to finish generating summary: {str(e)}"
+            return
+
+        # The finish reason arrives with the final chunk
+        if chunk is not None and GeminiAgent._hit_token_limit(chunk):
+            result['answer_truncated'] = True
+            yield TRUNCATION_NOTICE
+
+    @staticmethod
+    def _hit_token_limit(response: Any) -> bool:
+        """
+        Checks whether a Gemini response (or final stream chunk) stopped at
+        the max_output_tokens limit.
+
+        Args:
+            response: Response or response chunk from generate_content
+
+        Returns:
+            True if the first candidate's finish reason is MAX_TOKENS
+        """
+        candidates = getattr(response, 'candidates', None)
+        if not candidates:
+            return False
+        finish_reason = getattr(candidates[0], 'finish_reason', None)
+        return getattr(finish_reason, 'name', finish_reason) == 'MAX_TOKENS'
+
+    def run_pipeline(self, available_files: List[str]) -> List[Dict[str, Any]]:
+        """
+        Runs read_logs -> parse_logs -> analyze_logs through the MCP server
+        without consulting Gemini.
+
+        The allow-list must already be set via mcp_server.set_available_files.
+
+        Args:
+            available_files: List of allowed file names/paths to analyze
+
+        Returns:
+            Tool results in the same format as the agentic tool loop
         """
-        conversation_history = []
         tool_results = []
-        self.mcp_server.set_available_files(available_files)
 
-        # Build initial prompt with system instructions and available files
-        available_files_text = "\n".join(f"- {name}" for name in available_files)
-        prompt = f"""{self.system_prompt}
+        def run(tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+            result = self.mcp_server.execute_tool(tool_name, arguments)
+            tool_results.append({
+                'tool': tool_name,
+                'arguments': arguments,
+                'result': result
+            })
+            return result
 
-Available log files:
-{available_files_text}
+        read_result = run('read_logs', {'file_names': list(available_files)})
+        if not read_result.get('success'):
+            return tool_results
 
-User request:
-{user_query}
+        parse_result = run('parse_logs', {'log_text': "\n".join(read_result['files'].values())})
+        if not parse_result.get('success'):
+            return tool_results
 
-Remember: If you need to use a tool, respond ONLY with JSON: {{"tool": "tool_name", "arguments": {{...}}}}
+        run('analyze_logs', {'artifact_id': parse_result['artifact_id']})
+        return tool_results
 
-What is the first tool you need to call?"""
+    async def run_pipeline_batch(self, available_files: List[str], max_workers: int = 5) -> List[Dict[str, Any]]:
+        """
+        Runs the deterministic pipeline for each file concurrently and merges
+        the per-file analyses.
 
-        iteration = 0
-        tool_phase_complete = False
+        Args:
+            available_files: List of allowed file names/paths to analyze
+            max_workers: Maximum number of files processed at once
 
-        while iteration < max_iterations and not tool_phase_complete:
-            iteration += 1
+        Returns:
+            Per-file tool results, followed by a merge_analyses entry (listing
+            any skipped_files) when at least one file was analyzed successfully
+        """
+        semaphore = asyncio.Semaphore(max_workers)
 
-            # Get response from Gemini Pro
-            try:
-                full_prompt = prompt
-                if conversation_history:
-                    full_prompt += "\n\nPrevious conversation:\n" + "\n".join(conversation_history[-3:])
+        async def analyze_one(file_name: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await asyncio.to_thread(self.run_pipeline, [file_name])
 
-                response = self.model.generate_content(full_prompt)
-                response_text = response.text.strip()
+        per_file = await asyncio.gather(*(analyze_one(name) for name in available_files))
 
-                # Try to extract tool request
-                tool_request = self._extract_json_from_response(response_text)
+        tool_results = []
+        artifact_ids = []
+        skipped_files = []
+        for file_name, results in zip(available_files, per_file):
+            tool_results.extend(results)
+            if results[-1]['tool'] == 'analyze_logs' and results[-1]['result'].get('success'):
+                artifact_ids.append(results[-1]['arguments']['artifact_id'])
+            else:
+                skipped_files.append(file_name)
+
+        if artifact_ids:
+            # The server reuses the per-file analyses stored under these artifacts
+            arguments = {'artifact_ids': artifact_ids}
+            result = await asyncio.to_thread(self.mcp_server.execute_tool, 'merge_analyses', arguments)
+            if result.get('success'):
+                # Files whose pipeline failed are not part of the merged totals
+                result['skipped_files'] = skipped_files
+            tool_results.append({
+                'tool': 'merge_analyses',
+                'arguments': arguments,
+                'result': result
+            })
+        return tool_results
+
+    def process_query(self, user_query: str, available_files: List[str], max_iterations: int = 10,
+                      mode: str = 'agentic', stream: bool = False) -> Dict[str, Any]:
+        """
+        Synchronous entry point for process_query_async (used by the Streamlit UI).
 
-                if tool_request:
-                    # Execute tool via MCP server
-                    tool_name = tool_request['tool']
-                    tool_args = tool_request['arguments']
-
-                    result = self.mcp_server.execute_tool(tool_name, tool_args)
-                    tool_results.append({
-                        'tool': tool_name,
-                        'arguments': tool_args,
-                        'result': result
-                    })
-
-                    # Update conversation history
-                    conversation_history.append(f"Tool call: {tool_name} with args: {json.dumps(tool_args)}")
-                    conversation_history.append(f"Tool result: {json.dumps(result, indent=2)}")
-
-                    # Check if we need to continue or provide final answer
-                    if result.get('success'):
-                        if tool_name == 'analyze_logs':
-                            # Tool phase is complete - exit loop and enter ANSWER MODE
-                            tool_phase_complete = True
-                        else:
-                            # Continue with next tool
-                            prompt = f"""Tool "{tool_name}" executed successfully. Result: {json.dumps(result, indent=2)}
+        Args:
+            user_query: User's question about logs
+            available_files: List of allowed file names/paths for this session
+            max_iterations: Maximum number of tool calls allowed
+            mode: 'deterministic' or 'agentic' (see process_query_async)
+            stream: Return the final answer as an iterator of text chunks
 
-What is the next tool you need to call? Remember: respond ONLY with JSON if calling a tool."""
-                    else:
-                        # Tool execution failed
-                        error_prompt = f"""Tool execution failed: {result.get('error', 'Unknown error')}
+        Returns:
+            Dictionary with final answer and execution history
+        """
+        with self._loop_lock:
+            return self._loop.run_until_complete(
+                self.process_query_async(user_query, available_files, max_iterations, mode, stream)
+            )
+
+    def close(self) -> None:
+        """Closes the agent's event loop; the agent cannot be used afterwards."""
+        with self._loop_lock:
+            if not self._loop.is_closed():
+                self._loop.close()
+
+    def __del__(self):
+        # Agents dropped without close() (e.g. at session end) release their loop
+        loop = getattr(self, '_loop', None)
+        if loop is not None and not loop.is_closed() and not loop.is_running():
+            loop.close()
+
+    async def process_query_async(self, user_query: str, available_files: List[str], max_iterations: int = 10,
+                                  mode: str = 'agentic', stream: bool = False) -> Dict[str, Any]:
+        """
+        Process a user query by coordinating between Gemini Pro and MCP server.
 
-What should you do next? You can try a different tool or provide an answer based on what you know."""
-                        prompt = error_prompt
-                else:
-                    # No tool request found - retry with clearer instructions
-                    prompt = f"""Your response was not valid JSON. Please respond ONLY with JSON in this format:
-{{"tool": "tool_name", "arguments": {{"param": "value"}}}}
+        Gemini calls use the SDK's async API and tools run in worker threads,
+        which lets the per-file pipelines of a multi-file run overlap. An
+        agent still handles one query at a time (process_query holds its
+        loop lock for the whole run); the UI keeps one agent per session.
 
-User question: {user_query}
-Available tools: {', '.join(self.mcp_server.tools.keys())}"""
+        Args:
+            user_query: User's question about logs
+            available_files: List of allowed file names/paths for this session
+            max_iterations: Maximum number of tool calls allowed
+            mode: 'deterministic' runs the fixed read -> parse -> analyze pipeline
+                and only uses Gemini for the final answer; 'agentic' lets Gemini
+                choose each tool call
+            stream: Return the final answer as an iterator of text chunks that
+                are yielded as Gemini generates them, instead of a string
 
-            except Exception as e:
-                return {
-                    'success': False,
-                    'error': f'Error in agent processing: {str(e)}',
-                    'tool_results': tool_results,
-                    'final_answer': None
-                }
+        Returns:
+            Dictionary with final answer and execution history
+        """
+        if mode not in ('deterministic', 'agentic'):
+            raise ValueError(f"Unknown mode: {mode}")
+
+        tool_results = []
+        iteration = 0
+        self.mcp_server.set_available_files(available_files)
+        self.mcp_server.clear_artifacts()
+
+        try:
+            if mode == 'deterministic' and len(available_files) > 1:
+                # Fixed read -> parse -> analyze workflow, fanned out per file
+                tool_results = await self.run_pipeline_batch(available_files)
+            elif mode == 'deterministic':
+                # Fixed read -> parse -> analyze workflow: no LLM turns needed to pick tools
+                tool_results = await asyncio.to_thread(self.run_pipeline, available_files)
+            else:
+                iteration = await self._run_tool_loop(user_query, available_files, max_iterations, tool_results)
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'Error in agent processing: {str(e)}',
+                'tool_results': tool_results,
+                'final_answer': None
+            }
+
+        result = {
+            'success': True,
+            'final_answer': None,
+            'tool_results': tool_results,
+            'iterations': iteration
+        }
 
         # ANSWER MODE: Generate final natural language response
         final_answer = None
@@ -224,16 +551,29 @@ User question:
 {user_query}
 
 Tool execution results:
-{json.dumps(tool_results, indent=2)}
+{orjson.dumps(tool_results).decode()}
 
 Provide a clear, concise explanation that directly answers the user's question.
 Focus on insights, patterns, and key issues found in the logs."""
 
-                answer_response = self.model.generate_content(
-                    answer_prompt,
-                    generation_config={"temperature": 0.4}
-                )
-                final_answer = answer_response.text.strip()
+                answer_model = self.model_canned if mode == 'deterministic' else self.model_answer
+                if stream:
+                    answer_response = await asyncio.to_thread(
+                        answer_model.generate_content,
+                        answer_prompt,
+                        stream=True,
+                        generation_config={"temperature": 0.4}
+                    )
+                    final_answer = self._stream_text(answer_response, result)
+                else:
+                    answer_response = await answer_model.generate_content_async(
+                        answer_prompt,
+                        generation_config={"temperature": 0.4}
+                    )
+                    final_answer = answer_response.text.strip()
+                    if self._hit_token_limit(answer_response):
+                        result['answer_truncated'] = True
+                        final_answer += TRUNCATION_NOTICE
 
             except Exception as e:
                 final_answer = f"Tool execution completed but failed to generate summary: {str(e)}"
@@ -241,9 +581,104 @@ Focus on insights, patterns, and key issues found in the logs."""
         if not final_answer:
             final_answer = "I was unable to complete the analysis. Please check the tool execution results."
 
-        return {
-            'success': True,
-            'final_answer': final_answer,
-            'tool_results': tool_results,
-            'iterations': iteration
-        }
+        result['final_answer'] = final_answer
+        return result
+
+    async def _run_tool_loop(self, user_query: str, available_files: List[str], max_iterations: int,
+                             tool_results: List[Dict[str, Any]]) -> int:
+        """
+        Lets Gemini pick tools turn by turn until analyze_logs succeeds.
+
+        Args:
+            user_query: User's question about logs
+            available_files: List of allowed file names/paths for this session
+            max_iterations: Maximum number of tool calls allowed
+            tool_results: List that executed tool calls are appended to
+
+        Returns:
+            Number of iterations used
+        """
+        self._refresh_context_cache()
+
+        # Build initial prompt with available files; the system instructions are
+        # only inlined when they could not be registered in the context cache
+        available_files_text = "\n".join(f"- {name}" for name in available_files)
+        preamble = ""
+        if self.cache is None:
+            preamble = f"{self.system_prompt}\n\nTool reference:\n{self._tool_descriptions}\n\n"
+        prompt = f"""{preamble}Available log files:
+{available_files_text}
+
+User request:
+{user_query}
+
+Remember: If you need to use a tool, respond ONLY with JSON: {{"tool": "tool_name", "arguments": {{...}}}}
+
+What is the first tool you need to call?"""
+
+        # The chat session holds the history client-side and resends all of it
+        # with each message, so it is trimmed to the opening exchange (files
+        # and user request) plus the most recent exchanges
+        chat = self.model.start_chat(history=[])
+
+        iteration = 0
+        tool_phase_complete = False
+
+        while iteration < max_iterations and not tool_phase_complete:
+            iteration += 1
+
+            if len(chat.history) > 2 * (CHAT_HISTORY_WINDOW + 1):
+                chat.history = chat.history[:2] + chat.history[-2 * CHAT_HISTORY_WINDOW:]
+
+            # Get response from Gemini Pro
+            response = await chat.send_message_async(prompt, generation_config=self.tool_call_config)
+            response_text = response.text.strip()
+
+            # Try to extract tool request
+            tool_request = self._extract_json_from_response(response_text)
+
+            if tool_request:
+                # Execute tool via MCP server
+                tool_name = tool_request['tool']
+                tool_args = tool_request['arguments']
+
+                resolved_args, ref_error = self._resolve_result_refs(tool_args, tool_results)
+                if ref_error:
+                    result = {'success': False, 'error': ref_error}
+                else:
+                    result = await asyncio.to_thread(self.mcp_server.execute_tool, tool_name, resolved_args)
+                tool_results.append({
+                    'tool': tool_name,
+                    'arguments': tool_args,
+                    'result': result
+                })
+                result_ref = f"{RESULT_REF_PREFIX}{len(tool_results)}"
+
+                # Check if we need to continue or provide final answer
+                if result.get('success'):
+                    if tool_name in ANALYSIS_TOOLS:
+                        # Tool phase is complete - exit loop and enter ANSWER MODE
+                        tool_phase_complete = True
+                    else:
+                        # Continue with next tool
+                        summary = self._summarize_for_llm(result)
+                        prompt = f"""Tool "{tool_name}" executed successfully. Result (stored as "{result_ref}", large values truncated): {orjson.dumps(summary).decode()}
+
+To pass this result to the next tool, use "{result_ref}" as the argument value.
+
+What is the next tool you need to call? Remember: respond ONLY with JSON if calling a tool."""
+                else:
+                    # Tool execution failed (errors can echo large arguments)
+                    error = self._summarize_for_llm(result).get('error', 'Unknown error')
+                    error_prompt = f"""Tool execution failed: {error}
+
+What should you do next? You can try a different tool or provide an answer based on what you know."""
+                    prompt = error_prompt
+            else:
+                # No tool request found - retry with clearer instructions
+                prompt = f"""Your response was not valid JSON. Please respond ONLY with JSON in this format:
+{{"tool": "tool_name", "arguments": {{"param": "value"}}}}
+
+Available tools: {', '.join(self.mcp_server.tools.keys())}"""
+
+        return iteration
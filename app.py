@@ -6,25 +6,102 @@ the log analysis agent powered by Gemini Pro and MCP tools.
 """
 
 import streamlit as st
-import json
+import hashlib
+import orjson
 import os
+import shutil
+import threading
+import time
 from agent import GeminiAgent
 
 
+# Canned analysis types run the fixed read -> parse -> analyze pipeline;
+# anything else lets Gemini choose the tools
+DETERMINISTIC_ANALYSIS_TYPES = {"Overview", "Error-focused", "Warning-focused", "Service-focused"}
+
+# Tool results that hold analysis statistics (merge_analyses combines the
+# per-file analyze_logs results of multi-file runs)
+ANALYSIS_TOOLS = {"analyze_logs", "merge_analyses"}
+
+# Seconds a completed analysis is reused for an identical query over identical files
+ANALYSIS_CACHE_TTL = 600
+
+
+def get_agent(api_key: str) -> GeminiAgent:
+    """
+    Build one agent per browser session and reuse it across that session's reruns.
+
+    Agents are not shared between sessions: each one runs its queries one at
+    a time and holds the session's file allow-list and parsed logs.
+    """
+    if st.session_state.get('agent_api_key') != api_key:
+        previous = st.session_state.get('agent')
+        if previous is not None:
+            previous.close()
+        st.session_state.agent = GeminiAgent(api_key)
+        st.session_state.agent_api_key = api_key
+    return st.session_state.agent
+
+
+@st.cache_resource
+def analysis_cache() -> tuple:
+    """
+    Process-wide store of completed analyses: cache_key -> (stored_at, result).
+
+    Every session's script thread uses it, so it comes with a lock that
+    guards all access.
+    """
+    return {}, threading.Lock()
+
+
+def analysis_cache_key(analysis_type: str, user_query: str, available_files: list) -> str:
+    """Hash the analysis type, user query and file contents into a cache key."""
+    digest = hashlib.sha256(f"{analysis_type}|{user_query}".encode())
+    for fpath in sorted(available_files):
+        digest.update(f"|{fpath}|".encode())
+        try:
+            with open(fpath, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        except OSError:
+            continue
+    return digest.hexdigest()
+
+
+def get_cached_analysis(cache_key: str):
+    """Return a stored analysis for cache_key if it has not expired."""
+    cache, lock = analysis_cache()
+    with lock:
+        entry = cache.get(cache_key)
+    if entry and time.monotonic() - entry[0] < ANALYSIS_CACHE_TTL:
+        return entry[1]
+    return None
+
+
+def store_analysis(cache_key: str, result: dict) -> None:
+    """Store a completed analysis, dropping expired entries."""
+    cache, lock = analysis_cache()
+    now = time.monotonic()
+    with lock:
+        for key in [k for k, (stored_at, _) in cache.items() if now - stored_at >= ANALYSIS_CACHE_TTL]:
+            del cache[key]
+        cache[cache_key] = (now, result)
+
+
 def format_tool_result(result: dict) -> str:
     """Format a tool result for display."""
     if result.get('success'):
-        return json.dumps(result, indent=2)
+        return orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
     else:
         return f"Error: {result.get('error', 'Unknown error')}"
 
 
 def display_analysis_results(tool_results: list):
     """Display structured analysis results from analyze_logs tool."""
-    # Find the analyze_logs result
+    # Find the latest analysis (the merged one for multi-file runs)
     analysis_result = None
-    for tool_result in tool_results:
-        if tool_result['tool'] == 'analyze_logs' and tool_result['result'].get('success'):
+    for tool_result in reversed(tool_results):
+        if tool_result['tool'] in ANALYSIS_TOOLS and tool_result['result'].get('success'):
             analysis_result = tool_result['result']
             break
     
@@ -33,6 +110,9 @@ def display_analysis_results(tool_results: list):
     
     st.subheader("📊 Analysis Results")
     
+    if analysis_result.get('skipped_files'):
+        st.warning(f"⚠️ Not included (could not be analyzed): {', '.join(analysis_result['skipped_files'])}")
+    
     # Error counts
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -72,16 +152,16 @@ def display_analysis_results(tool_results: list):
     st.subheader("Service Statistics")
     service_stats = analysis_result.get('service_statistics', {})
     if service_stats:
-        # Create a summary table
-        stats_data = []
-        for service, stats in service_stats.items():
-            stats_data.append({
-                'Service': service,
-                'Total': stats['total'],
-                'Errors': stats['errors'],
-                'Warnings': stats['warnings'],
-                'Info': stats['info']
-            })
+        # Create a summary table, built column-wise so the DataFrame is
+        # constructed from lists instead of one dict per row
+        stats = service_stats.values()
+        stats_data = {
+            'Service': list(service_stats),
+            'Total': [s['total'] for s in stats],
+            'Errors': [s['errors'] for s in stats],
+            'Warnings': [s['warnings'] for s in stats],
+            'Info': [s['info'] for s in stats]
+        }
         st.dataframe(stats_data, use_container_width=True)
     
     st.divider()
@@ -142,7 +222,7 @@ def main():
     
     # Initialize agent
     try:
-        agent = GeminiAgent(api_key)
+        agent = get_agent(api_key)
     except Exception as e:
         st.error(f"Failed to initialize agent: {str(e)}")
         return
@@ -153,7 +233,7 @@ def main():
     # Analysis type selection
     analysis_type = st.radio(
         "Select analysis focus:",
-        ["Overview", "Error-focused", "Warning-focused", "Service-focused"],
+        ["Overview", "Error-focused", "Warning-focused", "Service-focused", "Free-form"],
         horizontal=True
     )
 
@@ -167,6 +247,8 @@ def main():
 
     if 'uploaded_files' not in st.session_state:
         st.session_state.uploaded_files = []
+    if 'upload_hashes' not in st.session_state:
+        st.session_state.upload_hashes = {}  # dest path -> content digest
 
     # Save uploaded files and track their paths
     new_uploaded_paths = []
@@ -174,8 +256,14 @@ def main():
         for up in uploaded_files:
             safe_name = os.path.basename(up.name)
             dest_path = os.path.join("data/uploads", safe_name)
-            with open(dest_path, "wb") as f:
-                f.write(up.read())
+            with up.getbuffer() as buf:
+                digest = hashlib.blake2b(buf, digest_size=16).hexdigest()
+            # Reruns re-deliver every upload; only write content that changed
+            if st.session_state.upload_hashes.get(dest_path) != digest or not os.path.exists(dest_path):
+                up.seek(0)
+                with open(dest_path, "wb") as f:
+                    shutil.copyfileobj(up, f, length=1 << 20)
+                st.session_state.upload_hashes[dest_path] = digest
             new_uploaded_paths.append(dest_path)
 
         # Update session state (deduplicate)
@@ -221,20 +309,29 @@ def main():
         # Build combined prompt
         combined_prompt = f"Analysis type: {analysis_type}\nUser question: {user_query}\nAvailable log files: {available_files}"
 
-        # Process query
-        with st.spinner("🤖 Agent is analyzing logs..."):
-            result = agent.process_query(combined_prompt, available_files=available_files)
-        
-        # Store result in session state
-        st.session_state.analysis_result = result
+        # Process query (identical query + file contents are served from cache)
+        cache_key = analysis_cache_key(analysis_type, user_query, available_files)
+        result = get_cached_analysis(cache_key)
+        if result is None:
+            mode = "deterministic" if analysis_type in DETERMINISTIC_ANALYSIS_TYPES else "agentic"
+            with st.spinner("🤖 Agent is analyzing logs..."):
+                result = agent.process_query(combined_prompt, available_files=available_files,
+                                             mode=mode, stream=True)
         
         # Display results
         if result.get('success'):
             st.success("✅ Analysis complete!")
             
-            # Display final answer
+            # Display final answer, streaming it in as Gemini generates it
             st.header("🤖 Agent's Explanation")
-            st.markdown(result.get('final_answer', 'No explanation provided.'))
+            final_answer = result.get('final_answer', 'No explanation provided.')
+            if isinstance(final_answer, str):
+                st.markdown(final_answer)
+            else:
+                result['final_answer'] = st.write_stream(final_answer)
+                # Answers cut off by a generation error are not reused
+                if not result.get('answer_error'):
+                    store_analysis(cache_key, result)
             
             st.divider()
             
@@ -253,6 +350,9 @@ def main():
             st.error(f"❌ Analysis failed: {result.get('error', 'Unknown error')}")
             if result.get('tool_results'):
                 st.json(result['tool_results'])
+
+        # Store result in session state
+        st.session_state.analysis_result = result
     
     # Display previous results if available
     if 'analysis_result' in st.session_state:
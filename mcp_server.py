@@ -8,11 +8,64 @@ This module implements the Model Context Protocol server that:
 4. Enforces strict separation between reasoning (LLM) and execution (tools)
 """
 
+import itertools
 import json
 import os
+import re
 from typing import Dict, Any, List, Optional, Tuple
 import tools
 
+try:
+    import orjson
+    _json_loads = orjson.loads  # raises orjson.JSONDecodeError, a json.JSONDecodeError subclass
+except ImportError:  # the MCP server itself only needs the standard library
+    _json_loads = json.loads
+
+# Characters that affect brace matching in JSON text
+_JSON_SPECIAL_RE = re.compile(r'[{}"\\]')
+
+
+def _extract_first_json_object(text: str) -> Optional[str]:
+    """
+    Finds the first balanced {...} object in text.
+
+    Braces inside JSON strings (including escaped quotes) are ignored, so
+    trailing prose or a second object after the first one is not captured.
+
+    Args:
+        text: Text that may contain a JSON object
+
+    Returns:
+        The object's source text, or None if there is no balanced object
+    """
+    start = text.find('{')
+    if start < 0:
+        return None
+
+    depth = 0
+    in_string = False
+    escaped_pos = -1  # position of a character escaped by a backslash
+    # Only jump between structural characters instead of visiting every one
+    for match in _JSON_SPECIAL_RE.finditer(text, start):
+        pos = match.start()
+        if pos == escaped_pos:
+            continue
+        char = text[pos]
+        if in_string:
+            if char == '\\':
+                escaped_pos = pos + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:pos + 1]
+    return None
+
 
 class MCPServer:
     """
@@ -30,6 +83,12 @@ class MCPServer:
         self.allowed_files: set[str] = set()
         self.set_available_files([])  # initialize allow-list
 
+        # Parsed logs kept server-side; only their IDs travel through the LLM
+        self._artifacts: Dict[str, Any] = {}
+        # analyze_logs results per artifact_id, reused by merge_analyses
+        self._analyses: Dict[str, Dict[str, Any]] = {}
+        self._artifact_ids = itertools.count(1)
+
         self.tools = {
             'read_logs': {
                 'name': 'read_logs',
@@ -43,7 +102,7 @@ class MCPServer:
             },
             'parse_logs': {
                 'name': 'parse_logs',
-                'description': 'Parses raw log text and extracts structured information including timestamp, level, service, and message.',
+                'description': 'Parses raw log text and extracts structured information including timestamp, level, service, and message. Returns an artifact_id for analyze_logs and a sample of entries.',
                 'parameters': {
                     'log_text': {
                         'type': 'string',
@@ -55,9 +114,19 @@ class MCPServer:
                 'name': 'analyze_logs',
                 'description': 'Analyzes parsed log entries to extract statistics including error counts, log level distribution, and top services with errors.',
                 'parameters': {
-                    'parsed_logs': {
+                    'artifact_id': {
+                        'type': 'string',
+                        'description': 'artifact_id returned by the parse_logs tool'
+                    }
+                }
+            },
+            'merge_analyses': {
+                'name': 'merge_analyses',
+                'description': 'Analyzes several parsed logs separately and merges their statistics into one result (e.g. one artifact per log file).',
+                'parameters': {
+                    'artifact_ids': {
                         'type': 'array',
-                        'description': 'List of parsed log dictionaries from parse_logs tool'
+                        'description': 'artifact_ids returned by the parse_logs tool'
                     }
                 }
             }
@@ -67,9 +136,19 @@ class MCPServer:
         self.tool_executors = {
             'read_logs': tools.read_logs,
             'parse_logs': tools.parse_logs,
-            'analyze_logs': tools.analyze_logs
+            'analyze_logs': tools.analyze_logs,
+            'merge_analyses': tools.merge_analyses
+        }
+
+        # Required parameter names per tool, precomputed for validation
+        self._required_params = {
+            name: frozenset(spec['parameters'].keys())
+            for name, spec in self.tools.items()
         }
 
+        # The registry is fixed after construction, so the tool list is built once
+        self._tools_list = tuple(self.tools.values())
+
     def set_available_files(self, file_names: List[str]) -> None:
         """
         Set the allow-list of readable files for the current session.
@@ -78,10 +157,13 @@ class MCPServer:
         """
         allowed = {self.default_log}
 
-        # Include any files actually present in the uploads directory
+        # Include any regular files actually present in the uploads directory
+        # (DirEntry caches the file type, so no extra stat per entry)
         if os.path.isdir(self.upload_dir):
-            for fname in os.listdir(self.upload_dir):
-                allowed.add(os.path.normpath(os.path.join(self.upload_dir, fname)))
+            with os.scandir(self.upload_dir) as entries:
+                for entry in entries:
+                    if not entry.name.startswith('.') and entry.is_file(follow_symlinks=False):
+                        allowed.add(os.path.normpath(entry.path))
 
         # Add any explicitly provided files that are inside the uploads dir
         for name in file_names:
@@ -93,16 +175,81 @@ class MCPServer:
             elif normalized == self.default_log:
                 allowed.add(normalized)
 
-        self.allowed_files = allowed
+        # Resolve symlinks once; entries whose real path escapes the allowed
+        # locations are dropped, and files are read via their real paths
+        upload_real = os.path.realpath(self.upload_dir) + os.sep
+        default_real = os.path.realpath(self.default_log)
+        self._allowed_real = {
+            path: real for path, real in zip(allowed, map(os.path.realpath, allowed))
+            if real == default_real or real.startswith(upload_real)
+        }
+
+        self.allowed_files = set(self._allowed_real)
+        self._allowed_files_sorted = None  # built lazily for error messages
     
-    def get_available_tools(self) -> List[Dict[str, Any]]:
+    def clear_artifacts(self) -> None:
+        """Drops all stored parse results (called when a new query starts)."""
+        self._artifacts.clear()
+        self._analyses.clear()
+
+    def _analyze_artifact(self, artifact_id: str) -> Dict[str, Any]:
         """
-        Returns list of available tools for the LLM.
+        Runs analyze_logs on a stored parse result, reusing an earlier analysis.
         
+        Args:
+            artifact_id: artifact_id returned by parse_logs
+            
         Returns:
-            List of tool definitions
+            Result of the analyze_logs tool
         """
-        return list(self.tools.values())
+        analysis = self._analyses.get(artifact_id)
+        if analysis is not None:
+            return analysis
+        
+        parsed_logs = self._artifacts.get(artifact_id)
+        if parsed_logs is None:
+            return {
+                'success': False,
+                'error': f"Unknown artifact_id: {artifact_id}"
+            }
+        
+        analysis = tools.analyze_logs(parsed_logs)
+        if analysis.get('success'):
+            self._analyses[artifact_id] = analysis
+        return analysis
+
+    def _store_parsed_logs(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Keeps parsed log entries server-side and returns a compact handle.
+        
+        Args:
+            result: Result of the parse_logs tool
+            
+        Returns:
+            Result with the entries replaced by an artifact_id and a sample
+        """
+        if not result.get('success'):
+            return result
+        
+        artifact_id = f"p_{next(self._artifact_ids)}"
+        parsed_logs = result['parsed_logs']
+        self._artifacts[artifact_id] = parsed_logs
+        return {
+            'success': True,
+            'artifact_id': artifact_id,
+            'total_lines': result['total_lines'],
+            'parseable_lines': result['parseable_lines'],
+            'sample': tools.log_entries(parsed_logs, range(min(5, result['total_lines'])))
+        }
+    
+    def get_available_tools(self) -> Tuple[Dict[str, Any], ...]:
+        """
+        Returns available tools for the LLM.
+        
+        Returns:
+            Tuple of tool definitions (shared; do not modify)
+        """
+        return self._tools_list
     
     def validate_tool_request(self, tool_name: str, arguments: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
         """
@@ -115,15 +262,12 @@ class MCPServer:
         Returns:
             Tuple of (is_valid, error_message)
         """
-        if tool_name not in self.tools:
+        required_params = self._required_params.get(tool_name)
+        if required_params is None:
             return False, f"Unknown tool: {tool_name}. Available tools: {list(self.tools.keys())}"
         
-        tool_def = self.tools[tool_name]
-        required_params = set(tool_def['parameters'].keys())
-        provided_params = set(arguments.keys())
-        
-        # Check if all required parameters are provided
-        missing_params = required_params - provided_params
+        # Check if all required parameters are provided (dict keys view, no set copy)
+        missing_params = required_params - arguments.keys()
         if missing_params:
             return False, f"Missing required parameters: {missing_params}"
 
@@ -140,12 +284,21 @@ class MCPServer:
                     continue
                 norm = os.path.normpath(name)
                 normalized.append(norm)
-                if norm not in self.allowed_files:
+                if norm not in self._allowed_real:
                     disallowed.append(name)
             if disallowed:
-                return False, f"File(s) not allowed: {disallowed}. Allowed files: {sorted(self.allowed_files)}"
+                if self._allowed_files_sorted is None:
+                    self._allowed_files_sorted = sorted(self.allowed_files)
+                return False, f"File(s) not allowed: {disallowed}. Allowed files: {self._allowed_files_sorted}"
             # replace arguments with normalized names to ensure exact paths
             arguments['file_names'] = normalized
+
+        # Additional validation for merge_analyses
+        if tool_name == 'merge_analyses':
+            artifact_ids = arguments.get('artifact_ids')
+            if (not isinstance(artifact_ids, list) or not artifact_ids
+                    or not all(isinstance(artifact_id, str) for artifact_id in artifact_ids)):
+                return False, "artifact_ids must be a non-empty list of artifact_id strings"
         
         return True, None
     
@@ -178,11 +331,22 @@ class MCPServer:
             
             # Handle different argument types
             if tool_name == 'read_logs':
-                result = executor(arguments['file_names'])
+                # Read the real paths resolved when the allow-list was built;
+                # results stay keyed by the requested names
+                file_names = arguments['file_names']
+                result = executor(file_names, resolved_paths=[self._allowed_real[name] for name in file_names])
             elif tool_name == 'parse_logs':
-                result = executor(arguments['log_text'])
+                result = self._store_parsed_logs(executor(arguments['log_text']))
             elif tool_name == 'analyze_logs':
-                result = executor(arguments['parsed_logs'])
+                result = self._analyze_artifact(arguments['artifact_id'])
+            elif tool_name == 'merge_analyses':
+                analyses = []
+                for artifact_id in arguments['artifact_ids']:
+                    analysis = self._analyze_artifact(artifact_id)
+                    if not analysis.get('success'):
+                        return analysis
+                    analyses.append(analysis)
+                result = executor(analyses)
             else:
                 result = {'success': False, 'error': f'Unknown tool executor: {tool_name}'}
             
@@ -206,45 +370,44 @@ class MCPServer:
         Returns:
             Dictionary with 'tool' and 'arguments' keys, or None if invalid
         """
-        try:
-            # Try to parse as JSON
-            parsed = json.loads(llm_response.strip())
-            
-            # Validate structure
-            if not isinstance(parsed, dict):
-                return None
-            
-            if 'tool' not in parsed or 'arguments' not in parsed:
+        text = llm_response.strip()
+        # Plain prose can never hold a request; skip scanning and parsing
+        if '{' not in text:
+            return None
+        
+        parsed = None
+        # A bare JSON response (the usual case) is parsed without a scan
+        if text[0] == '{' and text[-1] == '}':
+            try:
+                parsed = _json_loads(text)
+            except json.JSONDecodeError:
+                pass
+        
+        if parsed is None:
+            # Scan for the first balanced object and parse it; any text
+            # after it (prose, stray braces) is ignored
+            candidate = _extract_first_json_object(text)
+            if candidate is None:
                 return None
-            
-            tool_name = parsed['tool']
-            arguments = parsed['arguments']
-            
-            if not isinstance(tool_name, str) or not isinstance(arguments, dict):
+            try:
+                parsed = _json_loads(candidate)
+            except json.JSONDecodeError:
                 return None
-            
-            return {
-                'tool': tool_name,
-                'arguments': arguments
-            }
-            
-        except json.JSONDecodeError:
-            # Try to extract JSON from text if wrapped
-            json_match = None
-            # Look for JSON object in the response
-            start_idx = llm_response.find('{')
-            end_idx = llm_response.rfind('}') + 1
-            
-            if start_idx >= 0 and end_idx > start_idx:
-                try:
-                    json_str = llm_response[start_idx:end_idx]
-                    parsed = json.loads(json_str)
-                    if isinstance(parsed, dict) and 'tool' in parsed and 'arguments' in parsed:
-                        return {
-                            'tool': parsed['tool'],
-                            'arguments': parsed['arguments']
-                        }
-                except json.JSONDecodeError:
-                    pass
-            
+        
+        # Validate structure
+        if not isinstance(parsed, dict):
+            return None
+        
+        if 'tool' not in parsed or 'arguments' not in parsed:
+            return None
+        
+        tool_name = parsed['tool']
+        arguments = parsed['arguments']
+        
+        if not isinstance(tool_name, str) or not isinstance(arguments, dict):
             return None
+        
+        return {
+            'tool': tool_name,
+            'arguments': arguments
+        }
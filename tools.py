@@ -6,13 +6,85 @@ deterministic operations on log data. These tools are called by the
 MCP server based on requests from the LLM.
 """
 
+import functools
+import mmap
 import os
 import re
-from typing import List, Dict, Any
-from collections import Counter, defaultdict
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Optional, Union
+from collections import Counter
 
 
-def read_logs(file_names: List[str]) -> Dict[str, Any]:
+# Log line format: YYYY-MM-DD HH:MM:SS LEVEL [service-name] message
+# (anchored per line, so finditer can scan a whole file in one pass)
+_LOG_RE = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (\w+) \[([^\]\n]+)\] (.+)$',
+    re.MULTILINE
+)
+
+# Column names of parse_logs output and the matching per-entry field names
+_COLUMNS = ('line_numbers', 'timestamps', 'levels', 'services', 'messages')
+_ENTRY_FIELDS = ('line_number', 'timestamp', 'level', 'service', 'message')
+
+# Canonical level strings, so common levels share one object per process
+# (other levels are sys.intern'ed as they are parsed)
+_LEVEL_INTERN = {'INFO': 'INFO', 'ERROR': 'ERROR', 'WARN': 'WARN', 'DEBUG': 'DEBUG'}
+
+# Files larger than this (in bytes) are memory-mapped by _read_text
+_MMAP_THRESHOLD = 1 << 20
+
+# Upper bound on threads used by read_logs for multi-file requests
+_MAX_READ_WORKERS = 8
+
+# Number of distinct log texts whose parse_logs results are kept; larger
+# texts are never cached, so the cache holds at most a few MB of logs
+_PARSE_CACHE_SIZE = 8
+_PARSE_CACHE_MAX_LENGTH = 1 << 20
+
+# Number of error / warning entries included as samples in analyze_logs
+_SAMPLE_SIZE = 5
+
+
+def _read_text(path: str) -> str:
+    """
+    Reads a UTF-8 text file. Files larger than _MMAP_THRESHOLD are
+    memory-mapped and decoded straight from the mapping, so no intermediate
+    bytes copy of the file is made; smaller files are read in one call,
+    which is cheaper than setting up a mapping. Invalid UTF-8 sequences are
+    replaced rather than failing the whole file.
+
+    Args:
+        path: Path of the file to read
+
+    Returns:
+        File content with newlines normalized to '\n'
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ''
+        if size > _MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, 'utf-8', 'replace')
+        else:
+            text = str(f.read(), 'utf-8', 'replace')
+
+    # Match text-mode universal newline handling
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def _read_one(path: str) -> Union[str, Exception]:
+    """Reads one file for read_logs, returning any error instead of raising it."""
+    try:
+        return _read_text(path)
+    except Exception as e:
+        return e
+
+
+def read_logs(file_names: List[str], resolved_paths: Optional[List[str]] = None) -> Dict[str, Any]:
     """
     Reads allowed log files from disk.
 
@@ -22,6 +94,9 @@ def read_logs(file_names: List[str]) -> Dict[str, Any]:
 
     Args:
         file_names: List of file names or relative paths to read
+        resolved_paths: Real paths of file_names that the caller has already
+            checked against its allow-list (as the MCP server does); they
+            are then read as given, skipping the checks below
 
     Returns:
         Dictionary with file contents keyed by file name
@@ -31,12 +106,16 @@ def read_logs(file_names: List[str]) -> Dict[str, Any]:
 
     base_default = os.path.normpath('data/application.log')
     uploads_dir = os.path.normpath('data/uploads')
-    results: Dict[str, str] = {}
+    targets = []  # (requested name, result key, path to read)
 
-    for name in file_names:
+    for i, name in enumerate(file_names):
         if not isinstance(name, str):
             return {'success': False, 'error': f'Invalid file name type: {name!r}'}
 
+        if resolved_paths is not None:
+            targets.append((name, name, resolved_paths[i]))
+            continue
+
         normalized = os.path.normpath(name)
 
         # Enforce allow-list: default log or file within uploads dir
@@ -49,17 +128,54 @@ def read_logs(file_names: List[str]) -> Dict[str, Any]:
                 'error': f'File not allowed: {name}. Allowed files are data/application.log or files in data/uploads/.'
             }
 
-        try:
-            with open(normalized, 'r', encoding='utf-8') as f:
-                results[normalized] = f.read()
-        except FileNotFoundError:
+        targets.append((name, normalized, normalized))
+
+    # Several files are read concurrently so their I/O overlaps; a single
+    # file is read inline rather than paying for a thread pool
+    paths = [path for _, _, path in targets]
+    if len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=min(_MAX_READ_WORKERS, len(paths))) as executor:
+            contents = list(executor.map(_read_one, paths))
+    else:
+        contents = [_read_one(path) for path in paths]
+
+    results: Dict[str, str] = {}
+    for (name, key, _), content in zip(targets, contents):
+        if isinstance(content, FileNotFoundError):
             return {'success': False, 'error': f'File not found: {name}'}
-        except Exception as e:
-            return {'success': False, 'error': f'Error reading {name}: {str(e)}'}
+        if isinstance(content, Exception):
+            return {'success': False, 'error': f'Error reading {name}: {str(content)}'}
+        results[key] = content
 
     return {'success': True, 'files': results}
 
 
+def log_entries(parsed_logs: Dict[str, List[Any]], indices: Iterable[int]) -> List[Dict[str, Any]]:
+    """
+    Builds per-entry dictionaries from columnar parsed logs.
+    
+    Args:
+        parsed_logs: Columnar parsed logs from parse_logs
+        indices: Positions of the entries to build
+        
+    Returns:
+        List of log dictionaries with line_number, timestamp, level, service and message
+    """
+    columns = [parsed_logs[column] for column in _COLUMNS]
+    return [
+        {field: column[i] for field, column in zip(_ENTRY_FIELDS, columns)}
+        for i in indices
+    ]
+
+
+def _to_columns(entries: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Converts a list of log dictionaries into the columnar parse_logs layout."""
+    return {
+        column: [entry[field] for entry in entries]
+        for column, field in zip(_COLUMNS, _ENTRY_FIELDS)
+    }
+
+
 def parse_logs(log_text: str) -> Dict[str, Any]:
     """
     Parses log text and extracts structured information.
@@ -67,55 +183,112 @@ def parse_logs(log_text: str) -> Dict[str, Any]:
     Expected log format:
     YYYY-MM-DD HH:MM:SS LEVEL [service-name] message
     
+    Entries are stored column-wise: parsed_logs maps each of line_numbers,
+    timestamps, levels, services and messages to a list, with one position
+    per entry.
+    
+    Results for recently parsed texts up to _PARSE_CACHE_MAX_LENGTH
+    characters are cached, so the column lists may be shared between calls
+    and must not be modified.
+    
     Args:
         log_text: Raw log file content
         
     Returns:
         Dictionary with parsed log entries and metadata
     """
-    log_pattern = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) (\w+) \[([^\]]+)\] (.+)'
+    # Large logs are not kept alive by the cache (see _read_text)
+    if len(log_text) > _PARSE_CACHE_MAX_LENGTH:
+        return _parse_logs_uncached(log_text)
     
-    parsed_logs = []
-    lines = log_text.strip().split('\n')
+    result = _parse_logs_cached(log_text)
+    # Fresh outer dicts, so callers cannot alter the cached result's keys
+    return {**result, 'parsed_logs': dict(result['parsed_logs'])}
+
+
+def _parse_logs_uncached(log_text: str) -> Dict[str, Any]:
+    """Does the actual parsing for parse_logs; see there."""
+    text = log_text.strip()
+    line_numbers = []
+    timestamps = []
+    levels = []
+    services = []
+    messages = []
     
-    for line_num, line in enumerate(lines, 1):
-        if not line.strip():
-            continue
-            
-        match = re.match(log_pattern, line)
-        if match:
-            timestamp, level, service, message = match.groups()
-            parsed_logs.append({
-                'line_number': line_num,
-                'timestamp': timestamp,
-                'level': level.upper(),
-                'service': service,
-                'message': message
-            })
-        else:
-            # Handle unparseable lines
-            parsed_logs.append({
-                'line_number': line_num,
-                'timestamp': None,
-                'level': 'UNKNOWN',
-                'service': 'unknown',
-                'message': line
-            })
+    # Bind hot lookups to locals for the match loop
+    add_line_number = line_numbers.append
+    add_timestamp = timestamps.append
+    add_level = levels.append
+    add_service = services.append
+    add_message = messages.append
+    intern_level = _LEVEL_INTERN.get
+    # One shared string per distinct service name (first occurrence wins)
+    service_cache: Dict[str, str] = {}
+    canonical_service = service_cache.setdefault
+    
+    def append_unparsed(segment: str, first_line_num: int) -> int:
+        # Handle unparseable lines (blank lines are skipped but still counted);
+        # returns the number of entries added
+        added = 0
+        for offset, line in enumerate(segment.split('\n')):
+            if line.strip():
+                add_line_number(first_line_num + offset)
+                add_timestamp(None)
+                add_level('UNKNOWN')
+                add_service('unknown')
+                add_message(line)
+                added += 1
+        return added
+    
+    # Stream matches straight out of the regex engine; only the gaps between
+    # matches (unparseable or blank lines) are ever split into lines
+    line_num = 1
+    pos = 0
+    unparsed = 0
+    for match in _LOG_RE.finditer(text):
+        start = match.start()
+        if start > pos:
+            gap = text[pos:start - 1]  # complete lines, minus the final newline
+            unparsed += append_unparsed(gap, line_num)
+            line_num += gap.count('\n') + 1
+        
+        timestamp, level, service, message = match.groups()
+        add_line_number(line_num)
+        add_timestamp(timestamp)
+        add_level(intern_level(level) or sys.intern(level.upper()))
+        add_service(canonical_service(service, service))
+        add_message(message)
+        line_num += 1
+        pos = match.end() + 1
+    
+    if pos < len(text):
+        unparsed += append_unparsed(text[pos:], line_num)
     
     return {
         'success': True,
-        'parsed_logs': parsed_logs,
-        'total_lines': len(parsed_logs),
-        'parseable_lines': len([log for log in parsed_logs if log['timestamp'] is not None])
+        'parsed_logs': {
+            'line_numbers': line_numbers,
+            'timestamps': timestamps,
+            'levels': levels,
+            'services': services,
+            'messages': messages
+        },
+        'total_lines': len(levels),
+        # Every entry is either a regex match or an unparseable line
+        'parseable_lines': len(levels) - unparsed
     }
 
 
-def analyze_logs(parsed_logs: List[Dict[str, Any]]) -> Dict[str, Any]:
+_parse_logs_cached = functools.lru_cache(maxsize=_PARSE_CACHE_SIZE)(_parse_logs_uncached)
+
+
+def analyze_logs(parsed_logs: Union[Dict[str, List[Any]], List[Dict[str, Any]]]) -> Dict[str, Any]:
     """
     Analyzes parsed log entries to extract statistics.
     
     Args:
-        parsed_logs: List of parsed log dictionaries
+        parsed_logs: Columnar parsed logs from parse_logs (a list of parsed
+            log dictionaries is also accepted)
         
     Returns:
         Dictionary with analysis results including:
@@ -124,64 +297,78 @@ def analyze_logs(parsed_logs: List[Dict[str, Any]]) -> Dict[str, Any]:
         - Top services with errors
         - Service-level statistics
     """
-    if not parsed_logs:
+    if isinstance(parsed_logs, list):
+        parsed_logs = _to_columns(parsed_logs)
+    
+    levels = parsed_logs['levels']
+    services = parsed_logs['services']
+    
+    if not levels:
         return {
             'success': False,
             'error': 'No logs to analyze'
         }
     
-    # Count log levels
-    level_counts = Counter(log['level'] for log in parsed_logs)
+    # Count (level, service) pairs in a single C-level pass over the two
+    # columns; every per-level and per-service statistic is derived from them
+    pair_counts = Counter(zip(levels, services))
+    
+    level_counts = Counter()
+    service_totals = Counter()
+    service_errors = Counter()
+    service_warnings = Counter()
+    service_info = Counter()
+    
+    # Per-level service tallies, looked up once per pair instead of
+    # walking an if/elif chain of string comparisons
+    level_dispatch = {
+        'ERROR': service_errors,
+        'WARN': service_warnings,
+        'INFO': service_info
+    }
     
-    # Count errors by service
-    service_errors = defaultdict(int)
-    service_warnings = defaultdict(int)
-    service_info = defaultdict(int)
+    for (level, service), count in pair_counts.items():
+        level_counts[level] += count
+        service_totals[service] += count
+        service_level_counts = level_dispatch.get(level)
+        if service_level_counts is not None:
+            service_level_counts[service] += count
     
     error_logs = []
     warning_logs = []
     
-    for log in parsed_logs:
-        level = log['level']
-        service = log['service']
-        
+    # Only the first few errors / warnings are reported, so stop collecting
+    # (and scanning) once both samples are full
+    for i, level in enumerate(levels):
         if level == 'ERROR':
-            service_errors[service] += 1
-            error_logs.append(log)
+            if len(error_logs) < _SAMPLE_SIZE:
+                error_logs.append(i)
         elif level == 'WARN':
-            service_warnings[service] += 1
-            warning_logs.append(log)
-        elif level == 'INFO':
-            service_info[service] += 1
-    
-    # Get top services with errors
-    top_error_services = sorted(
-        service_errors.items(),
-        key=lambda x: x[1],
-        reverse=True
-    )[:10]
-    
-    # Get top services with warnings
-    top_warning_services = sorted(
-        service_warnings.items(),
-        key=lambda x: x[1],
-        reverse=True
-    )[:10]
+            if len(warning_logs) < _SAMPLE_SIZE:
+                warning_logs.append(i)
+        else:
+            continue
+        if len(error_logs) == len(warning_logs) == _SAMPLE_SIZE:
+            break
+    
+    # Get top services with errors / warnings (partial selection, no full sort)
+    top_error_services = service_errors.most_common(10)
+    top_warning_services = service_warnings.most_common(10)
     
     # Service-level statistics
-    service_stats = {}
-    all_services = set(log['service'] for log in parsed_logs)
-    for service in all_services:
-        service_stats[service] = {
-            'total': sum(1 for log in parsed_logs if log['service'] == service),
+    service_stats = {
+        service: {
+            'total': total,
             'errors': service_errors.get(service, 0),
             'warnings': service_warnings.get(service, 0),
             'info': service_info.get(service, 0)
         }
+        for service, total in service_totals.items()
+    }
     
     return {
         'success': True,
-        'total_logs': len(parsed_logs),
+        'total_logs': len(levels),
         'level_distribution': dict(level_counts),
         'error_count': level_counts.get('ERROR', 0),
         'warning_count': level_counts.get('WARN', 0),
@@ -189,6 +376,54 @@ def analyze_logs(parsed_logs: List[Dict[str, Any]]) -> Dict[str, Any]:
         'top_error_services': [{'service': s, 'count': c} for s, c in top_error_services],
         'top_warning_services': [{'service': s, 'count': c} for s, c in top_warning_services],
         'service_statistics': service_stats,
-        'error_logs_sample': error_logs[:5],  # Sample of first 5 errors
-        'warning_logs_sample': warning_logs[:5]  # Sample of first 5 warnings
+        'error_logs_sample': log_entries(parsed_logs, error_logs),  # Sample of first 5 errors
+        'warning_logs_sample': log_entries(parsed_logs, warning_logs)  # Sample of first 5 warnings
+    }
+
+
+def merge_analyses(analyses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merges analyze_logs results computed separately for several log files.
+    
+    Args:
+        analyses: Successful analyze_logs results
+        
+    Returns:
+        Dictionary in the same format as analyze_logs, covering all files
+    """
+    if not analyses:
+        return {
+            'success': False,
+            'error': 'No analyses to merge'
+        }
+    
+    level_counts = Counter()
+    service_stats = {}
+    error_logs = []
+    warning_logs = []
+    
+    for analysis in analyses:
+        level_counts.update(analysis['level_distribution'])
+        for service, stats in analysis['service_statistics'].items():
+            merged = service_stats.setdefault(service, {'total': 0, 'errors': 0, 'warnings': 0, 'info': 0})
+            for key, value in stats.items():
+                merged[key] += value
+        error_logs.extend(analysis['error_logs_sample'])
+        warning_logs.extend(analysis['warning_logs_sample'])
+    
+    service_errors = Counter({s: stats['errors'] for s, stats in service_stats.items() if stats['errors']})
+    service_warnings = Counter({s: stats['warnings'] for s, stats in service_stats.items() if stats['warnings']})
+    
+    return {
+        'success': True,
+        'total_logs': sum(analysis['total_logs'] for analysis in analyses),
+        'level_distribution': dict(level_counts),
+        'error_count': level_counts.get('ERROR', 0),
+        'warning_count': level_counts.get('WARN', 0),
+        'info_count': level_counts.get('INFO', 0),
+        'top_error_services': [{'service': s, 'count': c} for s, c in service_errors.most_common(10)],
+        'top_warning_services': [{'service': s, 'count': c} for s, c in service_warnings.most_common(10)],
+        'service_statistics': service_stats,
+        'error_logs_sample': error_logs[:_SAMPLE_SIZE],
+        'warning_logs_sample': warning_logs[:_SAMPLE_SIZE]
     }